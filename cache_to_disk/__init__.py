@@ -30,15 +30,20 @@ Modifications:
         - Expansion of shell variables and tilde-user values for directories/files
 """
 # Standard Library
+import atexit
 import fcntl
+import itertools
 import json
 import logging
+import mmap
 import os
 import pickle
+import signal
+import struct
+import threading
 import warnings
 from collections import namedtuple
 from contextlib import contextmanager
-from copy import deepcopy
 from datetime import datetime
 from os import getenv
 from os.path import (
@@ -47,24 +52,33 @@ from os.path import (
     expanduser,
     expandvars,
     getmtime,
-    isfile,
     join as join_path,
     realpath,
 )
-from time import sleep
+from time import monotonic, sleep, time
 from typing import Any, Callable, Dict, List, Optional, Tuple, Type
 
 import logging,os
 from datetime import datetime
-import shutil
 import uuid
 
+# orjson is optional; it parses and serializes the metadata schema several
+# times faster than the stdlib json module
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 def get_logger(name,console_enable = False,propagate = False, log_dir='/mnt/disk1/log'):
+    """Opt-in file/console logging; never called at import time
+
+    The format deliberately avoids %(funcName)s and %(lineno)d, which force
+    the logging module to walk the stack for every emitted record
+    """
     logger = logging.getLogger(name)
     logger.setLevel(logging.DEBUG)
     # formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    # formatter = logging.Formatter('%(asctime)s [PID %(process)d] %(levelname)s %(name)s - %(message)s')
-    formatter = logging.Formatter('%(asctime)s [PID %(process)d] %(levelname)s (%(name)s::%(funcName)s:%(lineno)d) - %(message)s')
+    formatter = logging.Formatter('%(asctime)s [PID %(process)d] %(levelname)s %(name)s - %(message)s')
     # remove all handlers
     for handler in logger.handlers[:]:
         logger.removeHandler(handler)
@@ -106,15 +120,12 @@ def get_logger(name,console_enable = False,propagate = False, log_dir='/mnt/disk
     logger.propagate = propagate
     return logger
 
-# logger = logging.getLogger(__name__)
+logger = logging.getLogger(__name__)
 
-logger = get_logger(__name__,console_enable = True,propagate = False, log_dir='/mnt/disk1/log')
+# Don't log unless the user explicitly adds a handler (or calls get_logger);
+# importing this module must not create directories or open log files
+logger.addHandler(logging.NullHandler())
 
-if logger.handlers is None:
-    # Don't log unless user explicitly adds a handler
-    logger.addHandler(logging.NullHandler())
-
-MAX_PICKLE_BYTES = 2**31 - 1
 DISK_CACHE_DIR = expanduser(
     expandvars(
         getenv("DISK_CACHE_DIR", join_path(dirname(realpath(__file__)), "disk_cache"))
@@ -132,6 +143,12 @@ DISK_CACHE_FILE_LOCK = "{}.lock".format(DISK_CACHE_FILE)
 # By default, retry lock attempts every 0.1 seconds for up to 5 seconds
 DISK_CACHE_LOCK_MAX_WAIT = float(getenv("DISK_CACHE_LOCK_MAX_WAIT", 10))
 DISK_CACHE_LOCK_INTERVAL = float(getenv("DISK_CACHE_LOCK_INTERVAL", 0.1))
+
+# Flush batched metadata updates to disk at most this often (seconds); pending
+# updates are also flushed at interpreter exit and on SIGTERM
+DISK_CACHE_METADATA_FLUSH_INTERVAL = float(
+    getenv("DISK_CACHE_METADATA_FLUSH_INTERVAL", 5.0)
+)
 DEFAULT_CACHE_AGE = int(getenv("DEFAULT_CACHE_AGE", 15))
 
 # Specify 0 for cache age days to keep forever; not recommended for obvious reasons
@@ -150,10 +167,16 @@ _CacheInfo = namedtuple("_CacheInfo", ["hits", "misses", "nocache"])
 # logger.debug('cache_to_disk package loaded; using DISK_CACHE_DIR=%s',
 #             os.path.relpath(DISK_CACHE_DIR, '.'))
 
+# One entropy read per process (the prefix) instead of a getrandom syscall
+# per temp file; pid + counter keep names unique within the host
+_MEMMAP_PREFIX = uuid.uuid4().hex[:8]
+_MEMMAP_COUNTER = itertools.count()
+
+
 def get_memmap_random_filepath():
-    filename = str(uuid.uuid4())
+    filename = "{}_{}_{}".format(_MEMMAP_PREFIX, os.getpid(), next(_MEMMAP_COUNTER))
     return os.path.join(DISK_CACHE_DIR,filename)
-    
+
 
 class NoCacheCondition(Exception):
     """Custom exception for user function to raise to prevent caching on a per-call basis
@@ -201,30 +224,53 @@ class LockTimeout(Exception):
     """Failed to acquire a lock after retrying to exhaustion"""
 
 
+def _acquire_flock(lockfd, path: str, flags: int) -> None:
+    """Acquire an flock within DISK_CACHE_LOCK_MAX_WAIT seconds or raise LockTimeout
+
+    On the main thread, block in the kernel under a SIGALRM deadline so the
+    waiter is woken the instant the holder releases, instead of polling.
+    Other threads cannot install signal handlers and fall back to the
+    non-blocking retry loop
+    """
+    if threading.current_thread() is threading.main_thread():
+        def _on_alarm(signum, frame):
+            raise LockTimeout("Unable to acquire lock on {}".format(path))
+
+        previous = signal.signal(signal.SIGALRM, _on_alarm)
+        signal.setitimer(signal.ITIMER_REAL, DISK_CACHE_LOCK_MAX_WAIT)
+        try:
+            fcntl.flock(lockfd, flags & ~fcntl.LOCK_NB)
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+        return
+    elapsed = 0.0
+    while elapsed < DISK_CACHE_LOCK_MAX_WAIT:
+        try:
+            fcntl.flock(lockfd, flags | fcntl.LOCK_NB)
+            return
+        except BlockingIOError:
+            logger.warning("Unable to get lock on %s, retry in %s seconds ...", path, DISK_CACHE_LOCK_INTERVAL)
+            sleep(DISK_CACHE_LOCK_INTERVAL)
+            elapsed += DISK_CACHE_LOCK_INTERVAL
+    raise LockTimeout("Unable to acquire lock on {}".format(path))
+
+
 @contextmanager
 def open_locked(path: str, mode: str, flags: int):
     """You can use this directly, or you can use the open_exclusive() or open_shared() wrappers"""
     with open("{}.lock".format(path), mode="w") as lockfd:
-        elapsed = 0
-        while elapsed < DISK_CACHE_LOCK_MAX_WAIT:
-            try:
-                fcntl.flock(lockfd, flags)
-                try:
-                    fd = open(path, mode=mode)
-                except IOError:
-                    # Close to release the lock and raise the exception
-                    # Some callers need to know about ENOENT, EPERM, etc.
-                    lockfd.close()
-                    raise
-                yield fd
-                fd.close()
-                lockfd.close()
-                break
-            except BlockingIOError:
-                logger.warning("Unable to get exclusive (write) lock on %s, retry in %s seconds ...", path, DISK_CACHE_LOCK_INTERVAL)
-                sleep(DISK_CACHE_LOCK_INTERVAL)
-        else:
-            raise LockTimeout("Unable to acquire write lock on {}".format(path))
+        _acquire_flock(lockfd, path, flags)
+        try:
+            fd = open(path, mode=mode)
+        except IOError:
+            # Close to release the lock and raise the exception
+            # Some callers need to know about ENOENT, EPERM, etc.
+            lockfd.close()
+            raise
+        yield fd
+        fd.close()
+        lockfd.close()
     # Lock is implicitly released when fd is closed
     return
 
@@ -239,20 +285,214 @@ def open_shared(path: str, mode='r'):
     return open_locked(path, mode, fcntl.LOCK_SH | fcntl.LOCK_NB)
 
 
+# In-process copy of the parsed metadata file, invalidated by mtime; saves a
+# flock + full JSON parse on every decorated call when the file is unchanged
+_metadata_cache: Dict[str, Any] = {"mtime": None, "data": None}
+_metadata_cache_lock = threading.Lock()
+
+
 def write_cache_file(cache_metadata_dict: Dict) -> None:
-    """Dump an object as JSON to a file"""
-    with open_exclusive(DISK_CACHE_FILE) as f:
-        return json.dump(cache_metadata_dict, f)
+    """Atomically replace the metadata file with a freshly serialized copy
+
+    The JSON is written to a uniquely named temp file and moved into place
+    with os.replace, which is atomic on POSIX: readers see either the old or
+    the new file, never a torn write, so they need no lock at all. The .lock
+    flock only serializes concurrent writers
+    """
+    tmp_path = "{}.tmp.{}.{}".format(DISK_CACHE_FILE, os.getpid(), uuid.uuid4().hex)
+    with open(DISK_CACHE_FILE_LOCK, mode="w") as lockfd:
+        _acquire_flock(lockfd, DISK_CACHE_FILE, fcntl.LOCK_EX)
+        try:
+            if orjson is not None:
+                payload = orjson.dumps(cache_metadata_dict)
+            else:
+                payload = json.dumps(cache_metadata_dict).encode()
+            with open(tmp_path, "wb") as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, DISK_CACHE_FILE)
+        finally:
+            if file_exists(tmp_path):
+                os.remove(tmp_path)
+    with _metadata_cache_lock:
+        try:
+            _metadata_cache["mtime"] = getmtime(DISK_CACHE_FILE)
+        except OSError:
+            _metadata_cache["mtime"] = None
+        _metadata_cache["data"] = cache_metadata_dict
+
+
+class _MetadataWriter:
+    """Batch metadata rewrites instead of dumping the full JSON on every update
+
+    Every cache insert used to rewrite the entire (growing) metadata dict to
+    disk under an exclusive lock, which is O(n^2) I/O over the life of a cold
+    cache. Instead, updates mark the metadata dict dirty and the dict is only
+    flushed when DISK_CACHE_METADATA_FLUSH_INTERVAL has elapsed since the last
+    flush. Pending updates are flushed at interpreter exit (atexit) and on
+    SIGTERM so nothing is lost on a clean shutdown. The on-disk file format is
+    unchanged
+    """
+
+    def __init__(self, flush_interval: float = DISK_CACHE_METADATA_FLUSH_INTERVAL):
+        self._lock = threading.Lock()
+        self._flush_interval = flush_interval
+        self._pending = None
+        self._dirty = False
+        self._last_flush = monotonic()
+
+    def mark_dirty(self, cache_metadata: Dict) -> None:
+        """Record an updated metadata dict, flushing it if a flush is due"""
+        with self._lock:
+            self._pending = cache_metadata
+            self._dirty = True
+            if monotonic() - self._last_flush > self._flush_interval:
+                self._flush_locked()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Write any pending metadata to disk immediately
+
+        timeout bounds the wait for the internal lock; signal handlers must
+        pass one, because the interrupted code may itself hold the lock and a
+        blocking acquire would deadlock. Returns False if the lock could not
+        be acquired in time
+        """
+        if timeout is None:
+            acquired = self._lock.acquire()
+        else:
+            acquired = self._lock.acquire(timeout=timeout)
+        if not acquired:
+            return False
+        try:
+            self._flush_locked()
+        finally:
+            self._lock.release()
+        return True
+
+    def pending(self) -> Optional[Dict]:
+        """Return the not-yet-flushed metadata dict, or None if clean"""
+        with self._lock:
+            return self._pending if self._dirty else None
+
+    def _flush_locked(self) -> None:
+        if self._dirty and self._pending is not None:
+            write_cache_file(self._pending)
+            self._dirty = False
+        self._last_flush = monotonic()
+
+
+_METADATA_WRITER = _MetadataWriter()
+
+_PREVIOUS_SIGTERM_HANDLER = None
+
+
+def _flush_metadata_on_sigterm(signum, frame) -> None:
+    # The handler runs on the main thread, which may have been interrupted
+    # while holding the writer lock mid-flush; a blocking acquire here would
+    # deadlock the process, so poll the lock and give up rather than wait
+    _METADATA_WRITER.flush(timeout=0)
+    previous = _PREVIOUS_SIGTERM_HANDLER
+    if callable(previous):
+        # Chain to whatever handler the application had installed before us
+        previous(signum, frame)
+        return
+    if previous == signal.SIG_IGN:
+        return
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+atexit.register(_METADATA_WRITER.flush)
+try:
+    _PREVIOUS_SIGTERM_HANDLER = signal.signal(
+        signal.SIGTERM, _flush_metadata_on_sigterm
+    )
+except ValueError:
+    # Not on the main thread; atexit alone has to do
+    pass
 
 
 def load_cache_metadata_json() -> Dict:
     """Load a JSON file, create it with empty cache structure if it doesn't exist"""
+    pending = _METADATA_WRITER.pending()
+    if pending is not None:
+        return pending
     try:
-        with open_shared(DISK_CACHE_FILE) as f:
-            return json.load(f)
+        mtime = getmtime(DISK_CACHE_FILE)
+    except OSError:
+        mtime = None
+    if mtime is not None:
+        with _metadata_cache_lock:
+            if _metadata_cache["mtime"] == mtime:
+                return _metadata_cache["data"]
+    try:
+        # No reader lock needed: write_cache_file publishes via atomic rename
+        with open(DISK_CACHE_FILE, "rb") as f:
+            if orjson is not None:
+                data = orjson.loads(f.read())
+            else:
+                data = json.load(f)
     except FileNotFoundError:
-        write_cache_file({_TOTAL_NUMCACHE_KEY: 0})
-        return {_TOTAL_NUMCACHE_KEY: 0}
+        data = {_TOTAL_NUMCACHE_KEY: 0}
+        write_cache_file(data)
+        return data
+    with _metadata_cache_lock:
+        _metadata_cache["mtime"] = mtime
+        _metadata_cache["data"] = data
+    return data
+
+
+# Per-entry sidecar recording max_age_days, so the hot paths never need the
+# central JSON metadata file: everything else about an entry is reconstructible
+# from its hashed filename
+_CACHE_META_SUFFIX = ".meta"
+
+# Sidecar files that may accompany a cache data file and are removed with it
+_CACHE_SIDECAR_SUFFIXES = (_CACHE_META_SUFFIX, ".json", ".buf", "_timestamp", ".lock")
+
+# How long a .meta sidecar may sit without its data file before the sweep
+# treats it as orphaned. Writers stamp the sidecar before publishing the data
+# file (the memmap flow renames the data file in even later), so a fresh
+# unpaired sidecar is usually a write in progress, not garbage
+_ORPHANED_META_GRACE_SECONDS = 3600
+
+
+def write_cache_age(file_path: str, max_age_days: int) -> None:
+    """Record a cache entry's max age in days in its per-file sidecar"""
+    with open(file_path + _CACHE_META_SUFFIX, "wb") as f:
+        f.write(struct.pack("<I", int(max_age_days)))
+
+
+def read_cache_age(file_path: str) -> Optional[int]:
+    """Return the max age in days recorded for a cache entry, or None if no sidecar"""
+    try:
+        with open(file_path + _CACHE_META_SUFFIX, "rb") as f:
+            return struct.unpack("<I", f.read(4))[0]
+    except (FileNotFoundError, struct.error):
+        return None
+
+
+def _remove_cache_entry(file_path: str) -> None:
+    """Remove a cache data file along with any sidecar files that accompany it"""
+    if os.path.exists(file_path):
+        os.remove(file_path)
+    for suffix in _CACHE_SIDECAR_SUFFIXES:
+        sidecar = file_path + suffix
+        if os.path.exists(sidecar):
+            os.remove(sidecar)
+
+
+def _is_cache_file_for(function_name: str, entry_name: str) -> bool:
+    """True if a directory entry is a cache data file for the named function"""
+    prefix = function_name + '_'
+    if not entry_name.startswith(prefix):
+        return False
+    root, _, ext = entry_name.rpartition('.')
+    if ext not in ('npy', 'pkl'):
+        return False
+    digest = root[len(prefix):]
+    return len(digest) == 40 and all(c in '0123456789abcdef' for c in digest)
 
 
 def ensure_dir(directory: str) -> None:
@@ -263,31 +503,38 @@ def ensure_dir(directory: str) -> None:
 
 import numpy as np
 
+_TMP_COUNTER = itertools.count()
+
+
+def _write_temp_path(file_path: str) -> str:
+    """Uniquely named temp path in the same directory, for atomic os.replace"""
+    return "{}.tmp.{}.{}".format(file_path, os.getpid(), next(_TMP_COUNTER))
+
+
 def try_save_numpy2(data: Any, file_path: str,rename_np_memmap_file:bool) -> bool:
     # check if data is numpy array
     if isinstance(data, np.ndarray):
-        with open_exclusive(file_path, "wb") as f:
-            np.save(f, data)
-            f.flush()
-            os.fsync(f.fileno())   
-            
-        file_bytes = os.path.getsize(file_path)
-        data_size = data.nbytes
-        # sleep to ensure file is written to disk
-        while file_bytes < data_size:
-            sleep(0.1)
-            file_bytes = os.path.getsize(file_path)
-            logger.warnings(f"File size {file_bytes} < data size {data_size} human readable {np.round(file_bytes/1024/1024,2)}MB < {np.round(data_size/1024/1024,2)}MB")
-        
-        cahce_ready = False
-        
-        while not cahce_ready:
-            try:
-                data = np.load(file_path, mmap_mode='c')
-                cahce_ready = True
-            except Exception as e:
-                logger.warning(f"Failed to load numpy file {file_path} {e}")
-                sleep(0.1)
+        tmp_path = _write_temp_path(file_path)
+        try:
+            with open(tmp_path, "wb") as f:
+                np.save(f, data)
+                f.flush()
+                # One fsync is a full durability barrier; after it returns
+                # the file size already reflects every write, no polling
+                os.fsync(f.fileno())
+            os.replace(tmp_path, file_path)
+        finally:
+            if file_exists(tmp_path):
+                os.remove(tmp_path)
+
+        # Single post-save verification; fsync already guarantees the write is
+        # complete, so a failure here means the file is genuinely bad, not
+        # still racing the writer
+        try:
+            data = np.load(file_path, mmap_mode='r')
+        except Exception as e:
+            logger.warning(f"Failed to load numpy file {file_path} {e}")
+            return False
         logger.info(f"Saved numpy file {file_path} size {data.nbytes} human readable {np.round(data.nbytes/1024/1024,2)}MB success")
         return True
     return False
@@ -302,48 +549,70 @@ def try_save_numpy2(data: Any, file_path: str,rename_np_memmap_file:bool) -> boo
         
 
 def rename_np_memmap(from_filepath, file_path: str,dtype,shape) -> bool:
+    if from_filepath != file_path:
+        logger.info(f"Moving numpy memmap file {from_filepath} to {file_path}")
+        # Both paths live in the cache directory, so this is one atomic VFS
+        # rename; shutil.move would fall back to copy + unlink
+        os.replace(from_filepath, file_path)
+        logger.info(f"Moved numpy memmap file {from_filepath} to {file_path}")
     meta_config = file_path+'.json'
-    with open_exclusive(meta_config, "w") as f:
+    tmp_path = _write_temp_path(meta_config)
+    with open(tmp_path, "w") as f:
         # dump meta data
         json.dump({'dtype':dtype.name,'shape':shape},f)
         f.flush()
         os.fsync(f.fileno())
-        if from_filepath != file_path:
-            logger.info(f"Moving numpy memmap file {from_filepath} to {file_path}")
-            
-            shutil.move(from_filepath,file_path)
-            # os.symlink(from_filepath, file_path)
-            logger.info(f"Moved numpy memmap file {from_filepath} to {file_path}")
-        if os.path.exists(file_path):
-            data = np.memmap(file_path, dtype=dtype, mode='r', shape=shape)
-            return data
+    os.replace(tmp_path, meta_config)
+    if os.path.exists(file_path):
+        data = np.memmap(file_path, dtype=dtype, mode='r', shape=shape)
+        return data
     return None
 
-def load_np_memmap(file_path: str) -> bool:
+def madvise_sequential(data: np.ndarray) -> None:
+    """Hint the kernel that a memory-mapped array will be scanned front-to-back once"""
+    underlying = getattr(data, '_mmap', None)
+    if underlying is not None and hasattr(mmap, 'MADV_SEQUENTIAL'):
+        underlying.madvise(mmap.MADV_SEQUENTIAL)
+
+
+def load_np_memmap(file_path: str, sequential: bool = False) -> bool:
     data = None
     meta_config = file_path+'.json'
     try:
-        with open_exclusive(meta_config, "r") as f:
+        # No lock needed to read the sidecar; mmap of the data file tolerates
+        # concurrent readers and the sidecar is tiny and write-once
+        with open(meta_config, "r") as f:
             #load meta data
             meta_data = json.load(f)
-            
+
             dtype = meta_data['dtype']
             shape = tuple(meta_data['shape'])
-            
+
             data = np.memmap(file_path, dtype=dtype, mode='r', shape=shape)
+            if sequential:
+                madvise_sequential(data)
     except Exception as e:
         logger.warning("Failed to load numpy file %s: %s", file_path, e)
-    
+
     return data
 
 def save_numpy(data: Any, file_path: str) -> bool:
     if isinstance(data, np.ndarray):
-        with open_exclusive(file_path, "wb") as f:
-            np.save(f, data)
-            f.flush()
-            os.fsync(f.fileno())
-            logger.info(f"Saved numpy file {file_path} size {data.nbytes} human readable {np.round(data.nbytes/1024/1024,2)}MB success")
-            return True
+        # Write to a uniquely named temp file and move it into place: the
+        # rename is atomic, so readers see the old entry or the new one but
+        # never a truncated write, and they need no lock
+        tmp_path = _write_temp_path(file_path)
+        try:
+            with open(tmp_path, "wb") as f:
+                np.save(f, data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, file_path)
+        finally:
+            if file_exists(tmp_path):
+                os.remove(tmp_path)
+        logger.info(f"Saved numpy file {file_path} size {data.nbytes} human readable {np.round(data.nbytes/1024/1024,2)}MB success")
+        return True
     else:
         logger.warning(f"Data is not numpy array or memmap array {type(data)} {file_path}")
         return False
@@ -351,17 +620,18 @@ def save_numpy(data: Any, file_path: str) -> bool:
     
     
 
-def load_numpy(file_path: str,mmap_mode) -> np.ndarray:
+def load_numpy(file_path: str, mmap_mode: str = 'r', sequential: bool = False) -> np.ndarray:
     data = None
     try:
-        with open_shared(file_path, "rb") as f:
-            pass
-            # data = np.load(f)      
-        # data = np.load(file_path, mmap_mode='c')
+        # mmap_mode='r' maps the file read-only and shared, so the kernel can
+        # reuse the same pages across every process reading this cache entry;
+        # pass 'c' explicitly if copy-on-write writability is needed
         data = np.load(file_path, mmap_mode=mmap_mode)
+        if sequential:
+            madvise_sequential(data)
     except Exception as e:
         logger.warning("Failed to load numpy file %s: %s", file_path, e)
-    
+
     return data
 
 
@@ -382,53 +652,150 @@ def pickle_big_data(data: Any, file_path: str,rename_np_memmap_file:bool) -> Non
         save_numpy(data, file_path)
         return
 
-    bytes_out = pickle.dumps(data, protocol=4)
-    with open_exclusive(file_path, "wb") as f_out:
-        for idx in range(0, len(bytes_out), MAX_PICKLE_BYTES):
-            f_out.write(bytes_out[idx: idx + MAX_PICKLE_BYTES])
-            # flush and fsync to ensure data is written to disk
+    buffers_path = file_path + ".buf"
+    tmp_path = _write_temp_path(file_path)
+    tmp_buffers_path = _write_temp_path(buffers_path)
+    buf_out = None
+
+    def _write_buffer(pickle_buffer: pickle.PickleBuffer) -> None:
+        # Out-of-band buffer (PEP 574): write the raw memoryview straight to a
+        # sidecar file, so contiguous arrays inside the payload never get
+        # copied into the pickle stream
+        nonlocal buf_out
+        if buf_out is None:
+            buf_out = open(tmp_buffers_path, "wb")
+        raw = pickle_buffer.raw()
+        buf_out.write(struct.pack("<Q", raw.nbytes))
+        buf_out.write(raw)
+
+    try:
+        with open(tmp_path, "wb") as f_out:
+            # Stream straight to the file; protocol 4+ has no 2**31 write
+            # limit, so there is no need to materialize the payload in RAM
+            pickle.Pickler(
+                f_out, protocol=pickle.HIGHEST_PROTOCOL, buffer_callback=_write_buffer
+            ).dump(data)
             f_out.flush()
             os.fsync(f_out.fileno())
+        # Publish via atomic rename so readers never observe a partial entry;
+        # the sidecar goes first so a reader of the new stream finds its
+        # buffers
+        if buf_out is None:
+            os.replace(tmp_path, file_path)
+            if file_exists(buffers_path):
+                # Stale sidecar left over from a previous cache of this key
+                os.remove(buffers_path)
+        else:
+            buf_out.flush()
+            os.fsync(buf_out.fileno())
+            buf_out.close()
+            os.replace(tmp_buffers_path, buffers_path)
+            os.replace(tmp_path, file_path)
+    finally:
+        # On failure (e.g. an unpicklable payload) close the sidecar fd and
+        # unlink whatever temp files never got renamed into place; nothing
+        # else sweeps *.tmp.* names
+        if buf_out is not None and not buf_out.closed:
+            buf_out.close()
+        for leftover in (tmp_path, tmp_buffers_path):
+            if file_exists(leftover):
+                os.remove(leftover)
+
+
+def read_pickle_buffers(file_path: str) -> Optional[List[bytes]]:
+    """Load out-of-band pickle buffers from the sidecar written by pickle_big_data"""
+    buffers_path = file_path + ".buf"
+    if not file_exists(buffers_path):
+        return None
+    buffers = []
+    with open(buffers_path, "rb") as f_in:
+        while True:
+            header = f_in.read(8)
+            if not header:
+                break
+            (nbytes,) = struct.unpack("<Q", header)
+            buffers.append(f_in.read(nbytes))
+    return buffers
+
 
+def unpickle_big_data(
+    file_path: str, is_npy: Optional[bool] = None, has_meta: Optional[bool] = None
+) -> Any:
+    """Return a Python object from a cache file
 
-def unpickle_big_data(file_path: str) -> Any:
-    """Return a Python object from a file containing pickled data in chunks"""
+    Callers that have already stat'ed the file (cache_exists) pass is_npy and
+    has_meta so format dispatch costs no additional stat syscalls here
+    """
     try:
-        if file_path.endswith('.npy'):
-            meta_config = file_path+'.json'
-            if os.path.exists(meta_config):
+        if is_npy is None:
+            is_npy = file_path.endswith('.npy')
+        if is_npy:
+            if has_meta is None:
+                has_meta = os.path.exists(file_path + '.json')
+            if has_meta:
                 return load_np_memmap(file_path)
             else:
-                return load_numpy(file_path,mmap_mode='c')
-        with open_shared(file_path, "rb") as f:
-            return pickle.load(f)
+                return load_numpy(file_path)
+        # No reader lock: writers publish entries via atomic rename
+        with open(file_path, "rb") as f:
+            return pickle.load(f, buffers=read_pickle_buffers(file_path))
     except Exception:  # noqa, pylint: disable=broad-except
         logger.warning("Failed to unpickle %s", file_path)
-        if file_path.endswith('.npy'):
-            return None
-        bytes_in = bytearray(0)
-        input_size = os.path.getsize(file_path)
-        with open_shared(file_path, mode="rb") as f_in:
-            for _ in range(0, input_size, MAX_PICKLE_BYTES):
-                bytes_in += f_in.read(MAX_PICKLE_BYTES)
-        return pickle.loads(bytes_in)
+        return None
 
 
 
 def get_age_of_file(filename: str, unit: str = "days") -> int:
-    """Return relative age of a file as a datetime.timedelta"""
-    age = datetime.today() - datetime.fromtimestamp(getmtime(filename))
-    return getattr(age, unit)
+    """Return the age of a file in whole days (or seconds) since last modification"""
+    seconds = time() - getmtime(filename)
+    return int(seconds // 86400) if unit == "days" else int(seconds)
 
 
 def get_files_in_directory(directory: str) -> List[str]:
     """Return all files in a directory, non-recursive"""
-    return [f for f in os.listdir(directory) if isfile(join_path(directory, f))]
+    # DirEntry.is_file() reuses the type returned by the directory read, so
+    # this costs no stat syscalls on most filesystems
+    return [e.name for e in os.scandir(directory) if e.is_file()]
 
 
 def delete_old_disk_caches() -> None:
+    # One directory read gives every entry plus its cached stat; no per-file
+    # exists/getmtime syscalls in either pass below
+    try:
+        stat_by_name = {e.name: e.stat() for e in os.scandir(DISK_CACHE_DIR)}
+    except FileNotFoundError:
+        stat_by_name = {}
+    now = time()
+    for name in list(stat_by_name):
+        if not name.endswith(_CACHE_META_SUFFIX):
+            continue
+        file_name = name[: -len(_CACHE_META_SUFFIX)]
+        file_path = join_path(DISK_CACHE_DIR, file_name)
+        if file_name not in stat_by_name:
+            # Unpaired sidecar: either an in-flight write or a leftover from
+            # a failed one; only reap it once it is old enough to be garbage
+            if now - stat_by_name[name].st_mtime > _ORPHANED_META_GRACE_SECONDS:
+                os.remove(file_path + _CACHE_META_SUFFIX)
+            continue
+        max_age_days = read_cache_age(file_path)
+        if max_age_days is None:
+            continue
+        age_days = int((now - stat_by_name[file_name].st_mtime) // 86400)
+        if age_days > max_age_days != UNLIMITED_CACHE_AGE:
+            logger.info(
+                "Removing stale cache file %s, > %d days", file_path, max_age_days
+            )
+            _remove_cache_entry(file_path)
+
+    # Legacy entries recorded only in the central JSON metadata file; entries
+    # with a .meta sidecar were already handled above
     cache_metadata = load_cache_metadata_json()
-    new_cache_metadata = deepcopy(cache_metadata)
+    # No deepcopy needed: only top-level keys are (re)assigned below, the
+    # nested per-function lists are rebuilt rather than mutated in place. This
+    # also stops an emptied function's stale entry surviving in the copy
+    new_cache_metadata = {
+        _TOTAL_NUMCACHE_KEY: cache_metadata.get(_TOTAL_NUMCACHE_KEY, 0)
+    }
     cache_changed = False
     for function_name, function_caches in cache_metadata.items():
         if function_name == _TOTAL_NUMCACHE_KEY:
@@ -436,27 +803,45 @@ def delete_old_disk_caches() -> None:
         to_keep = []
         for function_cache in function_caches:
             max_age_days = int(function_cache["max_age_days"])
-            file_name = join_path(DISK_CACHE_DIR, function_cache["file_name"])
-            if not file_exists(file_name):
+            entry_stat = stat_by_name.get(function_cache["file_name"])
+            if entry_stat is None:
                 cache_changed = True
                 continue
-            if not get_age_of_file(file_name) > max_age_days != UNLIMITED_CACHE_AGE:
+            age_days = int((now - entry_stat.st_mtime) // 86400)
+            if not age_days > max_age_days != UNLIMITED_CACHE_AGE:
                 to_keep.append(function_cache)
                 continue
+            file_name = join_path(DISK_CACHE_DIR, function_cache["file_name"])
             logger.info(
                 "Removing stale cache file %s, > %d days", file_name, max_age_days
             )
             cache_changed = True
-            os.remove(file_name)
+            _remove_cache_entry(file_name)
         if to_keep:
             new_cache_metadata[function_name] = to_keep
     if cache_changed:
-        write_cache_file(new_cache_metadata)
+        _METADATA_WRITER.mark_dirty(new_cache_metadata)
 
 
-def get_disk_cache_for_function(function_name: str) -> Optional[Dict]:
-    cache_metadata = load_cache_metadata_json()
-    return cache_metadata.get(function_name, None)
+def get_disk_cache_for_function(function_name: str) -> Optional[List[Dict]]:
+    entries = []
+    seen = set()
+    try:
+        dir_entries = list(os.scandir(DISK_CACHE_DIR))
+    except FileNotFoundError:
+        dir_entries = []
+    for entry in dir_entries:
+        if not _is_cache_file_for(function_name, entry.name):
+            continue
+        entries.append(
+            {"file_name": entry.name, "max_age_days": read_cache_age(entry.path)}
+        )
+        seen.add(entry.name)
+    # Legacy entries known only to the central JSON metadata file
+    for function_cache in load_cache_metadata_json().get(function_name) or []:
+        if function_cache["file_name"] not in seen:
+            entries.append(function_cache)
+    return entries or None
 
 
 def get_disk_cache_size_for_function(function_name: str) -> Optional[int]:
@@ -468,76 +853,75 @@ def get_disk_cache_size_for_function(function_name: str) -> Optional[int]:
 def delete_disk_caches_for_function(function_name: str) -> None:
     logger.debug("Removing cache entries for %s", function_name)
     n_deleted = 0
-    cache_metadata = load_cache_metadata_json()
-    if function_name not in cache_metadata:
-        return
-
-    functions_to_delete_cache_for = cache_metadata.pop(function_name)
-    for function_cache in functions_to_delete_cache_for:
-        file_name = join_path(DISK_CACHE_DIR, function_cache["file_name"])
-        if os.path.exists(file_name):
-            os.remove(file_name)
-        config_file = file_name+'.json'
-        if os.path.exists(config_file):
-            os.remove(config_file)
-            
-        config_file = file_name+'_timestamp'
-        if os.path.exists(config_file):
-            os.remove(config_file)
-        
+    try:
+        dir_entries = list(os.scandir(DISK_CACHE_DIR))
+    except FileNotFoundError:
+        dir_entries = []
+    for entry in dir_entries:
+        if not _is_cache_file_for(function_name, entry.name):
+            continue
+        _remove_cache_entry(entry.path)
         n_deleted += 1
+
+    # Legacy entries known only to the central JSON metadata file
+    cache_metadata = load_cache_metadata_json()
+    if function_name in cache_metadata:
+        for function_cache in cache_metadata.pop(function_name):
+            file_name = join_path(DISK_CACHE_DIR, function_cache["file_name"])
+            if os.path.exists(file_name):
+                _remove_cache_entry(file_name)
+                n_deleted += 1
+        write_cache_file(cache_metadata)
     logger.debug("Removed %s cache entries for %s", n_deleted, function_name)
-    write_cache_file(cache_metadata)
 
 
 def cache_exists(
-    cache_metadata: Dict, function_name: str,except_arg_names: List[str] = [], *args, **kwargs
+    cache_metadata: Dict, function_name: str, cache_key: str, *args, **kwargs
 ) -> Tuple[bool, Any]:
-    
-    if len(except_arg_names) >0:
-        assert len(args) == 0, f"except_arg_names:{except_arg_names} ,args should be empty args {args}"
-    for arg_name in except_arg_names:
-        if arg_name in kwargs:
-            kwargs.pop(arg_name)
-                
-    if function_name not in cache_metadata:
-        logger.info(f"Function {function_name} not in cache metadata")
-        return False, None
-    new_caches_for_function = []
-    cache_changed = False
-    
-    # is_npy = isinstance(function_value, np.ndarray)
-    # post_fix = ".npy" if is_npy else ".pkl"
-    # new_file_name = str(int(cache_metadata[_TOTAL_NUMCACHE_KEY]) + 1) + post_fix
-    new_file_name = get_hash_filename(function_name,str(args),str(kwargs))
-    new_file_name = new_file_name
+    """Look up a cached value by its pre-computed cache key
+
+    The key comes from get_hash_filename; args/kwargs are only needed for the
+    legacy-JSON age lookup and for log messages, not for keying
+    """
+    new_file_name = cache_key
     file_path_npy = join_path(DISK_CACHE_DIR, new_file_name+'.npy')
     file_path_pkl = join_path(DISK_CACHE_DIR, new_file_name+'.pkl')
-    is_npy = file_exists(file_path_npy)
-    is_pkl = file_exists(file_path_pkl)
-    if is_npy:
+    # One stat resolves existence, npy-vs-pkl and the entry's age all at once
+    is_npy = True
+    try:
+        entry_stat = os.stat(file_path_npy)
         file_name = file_path_npy
-    elif is_pkl:
-        file_name = file_path_pkl
-    else:
-        logger.info(f"Function {function_name} cache file {new_file_name} not found args:{str(args)} kwargs:{str(kwargs)}")
-        return False, None
-    max_age_days = UNLIMITED_CACHE_AGE
-    for function_cache in cache_metadata[function_name]:
-        if function_cache["args"] == str(args) and (function_cache["kwargs"] == str(kwargs)):
-            max_age_days = int(function_cache["max_age_days"])
-            break
+    except FileNotFoundError:
+        try:
+            entry_stat = os.stat(file_path_pkl)
+            file_name = file_path_pkl
+            is_npy = False
+        except FileNotFoundError:
+            logger.debug("Function %s cache file %s not found args:%s kwargs:%s",
+                         function_name, new_file_name, args, kwargs)
+            return False, None
+    max_age_days = read_cache_age(file_name)
+    if max_age_days is None:
+        # Entry cached before per-file .meta sidecars; look the age up in the
+        # legacy JSON metadata and migrate it to a sidecar
+        max_age_days = UNLIMITED_CACHE_AGE
+        for function_cache in cache_metadata.get(function_name, []):
+            if function_cache["args"] == str(args) and (function_cache["kwargs"] == str(kwargs)):
+                max_age_days = int(function_cache["max_age_days"])
+                break
+        write_cache_age(file_name, max_age_days)
 
-    if get_age_of_file(file_name) > max_age_days != UNLIMITED_CACHE_AGE:
-        logger.info(f"Cache file {file_name} is stale, removing args {args} kwargs {kwargs}")
-        os.remove(file_name)
-        cache_changed = True
+    age_days = int((time() - entry_stat.st_mtime) // 86400)
+    if age_days > max_age_days != UNLIMITED_CACHE_AGE:
+        logger.info("Cache file %s is stale, removing args %s kwargs %s", file_name, args, kwargs)
+        _remove_cache_entry(file_name)
     else:
-        function_value = unpickle_big_data(file_name)
+        has_meta = os.path.exists(file_name + '.json') if is_npy else False
+        function_value = unpickle_big_data(file_name, is_npy=is_npy, has_meta=has_meta)
         if function_value is not None:
             return True, function_value
         else:
-            logger.warning(f"Failed to load cache file {file_name} args {args} kwargs {kwargs}")
+            logger.warning("Failed to load cache file %s args %s kwargs %s", file_name, args, kwargs)
             return False, None
     return False, None
 
@@ -585,78 +969,77 @@ def cache_exists2(
 
 def cache_exists_for_function(function_name: str,except_arg_names,*args, **kwargs)-> Tuple[bool, Any]:
     cache_metadata = load_cache_metadata_json()
-    
-    return cache_exists(cache_metadata,function_name,except_arg_names,*args, **kwargs)
+    if len(except_arg_names) > 0:
+        assert len(args) == 0, f"except_arg_names:{except_arg_names} ,args should be empty args {args}"
+        kwargs = {k: v for k, v in kwargs.items() if k not in except_arg_names}
+    cache_key = get_hash_filename(function_name, *args, **kwargs)
+    return cache_exists(cache_metadata, function_name, cache_key, *args, **kwargs)
 
-def cache_exists_rename_to_hash():
-    cache_metadata = load_cache_metadata_json()
-    for function_name, function_caches in cache_metadata.items():
-        if function_name == _TOTAL_NUMCACHE_KEY:
-            continue
-        to_keep = []
-        for function_cache in function_caches:
-            max_age_days = int(function_cache["max_age_days"])
-            old_filename = function_cache["file_name"]
-            file_postfix = old_filename.split('.')[-1]
-            hash_filename = get_hash_filename(function_name,function_cache["args"],function_cache["kwargs"])
-            hash_filename = hash_filename + '.' + file_postfix
-            
-            if old_filename != hash_filename:
-                logger.info(f"Renaming cache file {old_filename} to {hash_filename}")
-                os.rename(join_path(DISK_CACHE_DIR, old_filename),join_path(DISK_CACHE_DIR, hash_filename))
-                logger.info(f"Renamed cache file {old_filename} to {hash_filename}")
-                function_cache["file_name"] = hash_filename
-            to_keep.append(function_cache)
-        cache_metadata[function_name] = to_keep
-    
-    write_cache_file(cache_metadata)
-    
+# cache_exists_rename_to_hash used to rename counter-named cache files to
+# their hash names from the args/kwargs repr strings stored in the metadata
+# JSON. Content-based keys cannot be reconstructed from those strings, so the
+# migration is no longer implementable; legacy entries simply miss and get
+# recomputed under their new key
 
 import hashlib
 
-def get_hash_filename(function_name,*args,**kwargs):
-    # Generate a unique, human-readable filename based on input parameters
-    filename = function_name+'_'+str(args)+'_'+str(kwargs)
+def _hash_arg(h, arg):
+    if isinstance(arg, np.ndarray):
+        # str(ndarray) truncates big arrays with an ellipsis, so two different
+        # arrays used to collide on the same cache key; hash the raw bytes
+        # plus shape and dtype instead
+        h.update(arg.tobytes(order='C'))
+        h.update(str(arg.shape).encode())
+        h.update(str(arg.dtype).encode())
+        return
+    try:
+        h.update(pickle.dumps(arg, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:  # noqa, pylint: disable=broad-except
+        h.update(str(arg).encode())
 
-    hash_str = hashlib.sha1(str(filename).encode()).hexdigest()
-    filename = f"{function_name}_{hash_str}"
-    return filename
+
+def get_hash_filename(function_name,*args,**kwargs):
+    # Generate a unique filename from the function name and argument contents
+    h = hashlib.blake2b(digest_size=20)
+    h.update(function_name.encode())
+    for arg in args:
+        _hash_arg(h, arg)
+    for key in sorted(kwargs):
+        h.update(key.encode())
+        _hash_arg(h, kwargs[key])
+    return f"{function_name}_{h.hexdigest()}"
 
 def cache_function_value(
     function_value: Any,
     n_days_to_cache: int,
-    cache_metadata: Any,
     rename_np_memmap_file:bool,
     function_name: str,
-    *args,
-    **kwargs,
+    cache_key: str,
 ) -> None:
     if function_name == _TOTAL_NUMCACHE_KEY:
         raise Exception("Cant cache function named %s" % _TOTAL_NUMCACHE_KEY)
-    
 
     is_npy = isinstance(function_value, np.ndarray)
     post_fix = ".npy" if is_npy else ".pkl"
-    # new_file_name = str(int(cache_metadata[_TOTAL_NUMCACHE_KEY]) + 1) + post_fix
-    new_file_name = get_hash_filename(function_name,str(args),str(kwargs))
-    new_file_name = new_file_name + post_fix
-    new_cache = {
-        "args": str(args),
-        "kwargs": str(kwargs),
-        "file_name": new_file_name,
-        "max_age_days": n_days_to_cache,
-    }
+    new_file_name = cache_key + post_fix
     new_filepath = join_path(DISK_CACHE_DIR, new_file_name)
-    pickle_big_data(function_value, new_filepath,rename_np_memmap_file)
-    
-    # with open_shared(DISK_CACHE_FILE,mode='r+') as f:
-    #     cache_metadata = json.load(f)
-    function_caches = cache_metadata.get(function_name, [])
-    function_caches.append(new_cache)
-    cache_metadata[function_name] = function_caches
-    cache_metadata[_TOTAL_NUMCACHE_KEY] = int(cache_metadata[_TOTAL_NUMCACHE_KEY]) + 1
-        # json.dump(cache_metadata, f)
-    write_cache_file(cache_metadata)
+    # The hashed filename encodes everything about the entry except its max
+    # age, which lives in the per-file sidecar; no central index to rewrite.
+    # The sidecar must be stamped before the data file is published: a reader
+    # that can stat the entry but finds no sidecar takes the legacy-migration
+    # branch and would stamp it UNLIMITED_CACHE_AGE
+    write_cache_age(
+        new_filepath,
+        UNLIMITED_CACHE_AGE if n_days_to_cache is None else n_days_to_cache,
+    )
+    try:
+        pickle_big_data(function_value, new_filepath,rename_np_memmap_file)
+    except BaseException:
+        # Don't leave a sidecar for an entry that never materialized
+        meta_path = new_filepath + _CACHE_META_SUFFIX
+        if file_exists(meta_path):
+            os.remove(meta_path)
+        raise
     return new_filepath
 
 # F = TypeVar("F", bound=Callable[..., Any])
@@ -685,10 +1068,18 @@ def _cache_to_disk_wrapper(
     hits = misses = nocache = 0
 
     def wrapper(*args, **kwargs) -> Any:
-        nonlocal hits, misses, nocache 
+        nonlocal hits, misses, nocache
+        if len(except_arg_names) >0:
+            assert len(args) == 0, f"except_arg_names:{except_arg_names} ,args should be empty args {args}"
+            kwargs_for_key = {k: v for k, v in kwargs.items() if k not in except_arg_names}
+        else:
+            kwargs_for_key = kwargs
+        # Hash the arguments exactly once per call; both the lookup and the
+        # insert reuse the same key
+        cache_key = get_hash_filename(original_func.__name__, *args, **kwargs_for_key)
         cache_metadata = load_cache_metadata_json()
         already_cached, function_value = cache_exists(
-            cache_metadata, original_func.__name__,except_arg_names, *args, **kwargs
+            cache_metadata, original_func.__name__, cache_key, *args, **kwargs_for_key
         )
         if already_cached:
             logger.debug(
@@ -708,11 +1099,14 @@ def _cache_to_disk_wrapper(
             misses,
             nocache,
         )
-        logger.debug(" -- MISS ARGS:    (%s)", ",".join([str(arg) for arg in args]))
-        logger.debug(
-            " -- MISS KWARGS:  (%s)",
-            ",".join(["{}={}".format(str(k), str(v)) for k, v in kwargs.items()]),
-        )
+        if logger.isEnabledFor(logging.DEBUG):
+            # Stringifying large arguments is expensive; skip it outright
+            # unless debug logging is actually enabled
+            logger.debug(" -- MISS ARGS:    (%s)", ",".join([str(arg) for arg in args]))
+            logger.debug(
+                " -- MISS KWARGS:  (%s)",
+                ",".join(["{}={}".format(str(k), str(v)) for k, v in kwargs.items()]),
+            )
         misses += 1
 
         try:
@@ -726,33 +1120,20 @@ def _cache_to_disk_wrapper(
             function_value = err.function_value
         else:
             logger.debug("%s() returned, adding cache entry", original_func.__name__)
-            
-            if len(except_arg_names) >0:
-                assert len(args) == 0, f"except_arg_names:{except_arg_names} ,args should be empty args {args}"
-                logger.info(f"Removing except_arg_names {except_arg_names} from kwargs {kwargs.keys()}")
-            
-            for arg_name in except_arg_names:
-                if arg_name in kwargs:
-                    kwargs.pop(arg_name)
-            cache_metadata = load_cache_metadata_json()
             new_filepath = cache_function_value(
                 function_value,
                 n_days_to_cache,
-                cache_metadata, # Function Reentrancy
                 rename_np_memmap_file,
                 original_func.__name__,
-                *args,
-                **kwargs,
+                cache_key,
             )
         
             if isinstance(function_value, np.memmap)and rename_np_memmap_file:
                 old_file_path = function_value.filename
                 dtype = function_value.dtype
                 shape = function_value.shape
-                #close the memmap file
-                # del function_value 
-                
-                # function_value = 
+                # Push any dirty pages to disk before the file is renamed
+                function_value.flush()
                 function_value = rename_np_memmap(old_file_path, new_filepath,dtype=dtype,shape=shape)
         return function_value
 